@@ -1,10 +1,28 @@
+import asyncio
+import inspect
+import threading
+import time
+
+
+_account_lock_guard = threading.Lock()
+
+
 class Account:
     _successor = None
     _balance = None
+    _lock = None
 
     def set_next(self, account):
         self._successor = account
 
+    def lock(self):
+        # Created on first use and shared by every ledger that pays from this account
+        if self._lock is None:
+            with _account_lock_guard:
+                if self._lock is None:
+                    self._lock = threading.Lock()
+        return self._lock
+
     def pay(self, amount_to_pay):
         instance_class_name = self.__class__.__name__
         if self.can_pay(amount_to_pay):
@@ -41,6 +59,165 @@ class Bitcoin(Account):
         self._balance = balance
 
 
+class CompiledChain:
+    _accounts = None
+    _positions = None
+    _tree = None
+    _size = None
+
+    def __init__(self, head: Account):
+        self._accounts = []
+        account = head
+        while account:
+            self._accounts.append(account)
+            account = account._successor
+        self._positions = {id(account): position for position, account in enumerate(self._accounts)}
+
+        # Max segment tree over balances in chain order; leaf i lives at _tree[_size + i]
+        size = 1
+        while size < len(self._accounts):
+            size *= 2
+        self._size = size
+        self._tree = [float('-inf')] * (2 * size)
+        for position, account in enumerate(self._accounts):
+            self._tree[size + position] = account._balance
+        for node in range(size - 1, 0, -1):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def update(self, account: Account):
+        node = self._size + self._positions[id(account)]
+        self._tree[node] = account._balance
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def find(self, amount_to_pay):
+        tree = self._tree
+        if tree[1] < amount_to_pay:
+            return None
+        node = 1
+        while node < self._size:
+            node *= 2
+            if tree[node] < amount_to_pay:
+                node += 1
+        return self._accounts[node - self._size]
+
+    def pay(self, amount_to_pay):
+        account = self.find(amount_to_pay)
+        if account is None:
+            raise ValueError('None of the accounts have enough _balance')
+        return account
+
+    def pay_many(self, amounts):
+        find = self.find
+        paid_with = []
+        for amount_to_pay in amounts:
+            account = find(amount_to_pay)
+            if account is None:
+                raise ValueError('None of the accounts have enough _balance')
+            paid_with.append(account)
+        return paid_with
+
+
+class LedgerChain:
+    _accounts = None
+    _locks = None
+    _contention = None
+
+    def __init__(self, head: Account):
+        self._accounts = []
+        account = head
+        while account:
+            self._accounts.append(account)
+            account = account._successor
+        self._locks = [account.lock() for account in self._accounts]
+        self._contention = [0] * len(self._accounts)
+
+    def pay(self, amount_to_pay):
+        # Locks are only ever taken in chain order and one at a time, so payers cannot deadlock
+        for position, account in enumerate(self._accounts):
+            lock = self._locks[position]
+            if not lock.acquire(blocking=False):
+                lock.acquire()
+                self._contention[position] += 1
+            try:
+                if account.can_pay(amount_to_pay):
+                    account._balance -= amount_to_pay
+                    return account
+            finally:
+                lock.release()
+        raise ValueError('None of the accounts have enough _balance')
+
+    def contention(self):
+        return sum(self._contention)
+
+
+class AsyncChain:
+    _accounts = None
+    _timeout = None
+
+    def __init__(self, head: Account, timeout=None):
+        self._accounts = []
+        account = head
+        while account:
+            self._accounts.append(account)
+            account = account._successor
+        self._timeout = timeout
+
+    async def _probe(self, account, amount_to_pay):
+        # Blocking can_pay implementations run on a worker thread, so they overlap and the timeout covers them too
+        if inspect.iscoroutinefunction(account.can_pay):
+            result = account.can_pay(amount_to_pay)
+        else:
+            result = asyncio.to_thread(account.can_pay, amount_to_pay)
+        try:
+            return await asyncio.wait_for(result, self._timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def pay(self, amount_to_pay):
+        probes = [asyncio.ensure_future(self._probe(account, amount_to_pay)) for account in self._accounts]
+        try:
+            for account, probe in zip(self._accounts, probes):
+                if await probe:
+                    return account
+            raise ValueError('None of the accounts have enough _balance')
+        finally:
+            for probe in probes:
+                probe.cancel()
+
+
+def benchmark_ledger(thread_count=4, payments_per_thread=10000, amount_to_pay=1):
+    payments = thread_count * payments_per_thread
+    bank = Bank(payments * amount_to_pay // 3)
+    paypal = Paypal(payments * amount_to_pay // 3)
+    bitcoin = Bitcoin(payments * amount_to_pay)
+    bank.set_next(paypal)
+    paypal.set_next(bitcoin)
+    starting_total = bank._balance + paypal._balance + bitcoin._balance
+
+    ledger = LedgerChain(bank)
+
+    def payer():
+        for _ in range(payments_per_thread):
+            ledger.pay(amount_to_pay)
+
+    threads = [threading.Thread(target=payer) for _ in range(thread_count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    assert bank._balance + paypal._balance + bitcoin._balance == starting_total - payments * amount_to_pay
+    assert min(bank._balance, paypal._balance, bitcoin._balance) >= 0
+
+    print(str(thread_count) + ' threads: ' + str(int(payments / elapsed)) + ' payments/s, '
+          + str(ledger.contention()) + ' contended lock acquisitions')
+
+
 if __name__ == '__main__':
     bank = Bank(100)
     paypal = Paypal(200)
@@ -50,3 +227,28 @@ if __name__ == '__main__':
     paypal.set_next(bitcoin)
 
     bank.pay(259)
+
+    chain = CompiledChain(bank)
+    for amount, account in zip([50, 150, 259], chain.pay_many([50, 150, 259])):
+        print('Paid $' + str(amount) + ' using ' + account.__class__.__name__)
+
+    ledger = LedgerChain(Bank(100))
+    ledger.pay(60)
+    try:
+        ledger.pay(60)  # Bank now only holds $40
+    except ValueError as error:
+        print(error)
+
+    benchmark_ledger()
+
+    class SlowBank(Bank):
+        async def can_pay(self, amount: int):
+            await asyncio.sleep(0.1)
+            return self._balance >= amount
+
+    slow_bank = SlowBank(100)
+    slow_bitcoin = SlowBank(300)
+    slow_bank.set_next(slow_bitcoin)
+
+    account = asyncio.run(AsyncChain(slow_bank, timeout=1).pay(259))
+    print('Paid $259 using ' + account.__class__.__name__)  # After ~0.1s, not ~0.2s
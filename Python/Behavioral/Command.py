@@ -1,12 +1,30 @@
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+
+
 class Bulb:
+    _lit = False
+
     def turn_on(self):
+        self._lit = True
         print('Bulb has been lit')
 
     def turn_off(self):
+        self._lit = False
         print('Darkness!')
 
+    def is_lit(self):
+        return self._lit
+
 
 class Command:
+    # Set on commands that only set their receiver's state, so a later one of them makes an earlier one redundant
+    coalesces = False
+
     def execute(self):
         pass
 
@@ -16,8 +34,12 @@ class Command:
     def redo(self):
         pass
 
+    def receiver(self):
+        return None
+
 
 class TurnOn(Command):
+    coalesces = True
     _bulb = None
 
     def __init__(self, bulb):
@@ -32,8 +54,12 @@ class TurnOn(Command):
     def redo(self):
         self.execute()
 
+    def receiver(self):
+        return self._bulb
+
 
 class TurnOff(Command):
+    coalesces = True
     _bulb = None
 
     def __init__(self, bulb: Bulb):
@@ -48,12 +74,309 @@ class TurnOff(Command):
     def redo(self):
         self.execute()
 
+    def receiver(self):
+        return self._bulb
+
+
+class CommandJournal:
+    _COMMANDS = [TurnOn, TurnOff]
+    _HEADER = struct.Struct('<BBH')
+
+    _path = None
+    _file = None
+    _keys = None
+    _buffer = None
+    _buffered = 0
+    _group_size = None
+    _group_interval = None
+    _durable = False
+    _appended = 0
+    _committed = 0
+    _closed = False
+    _condition = None
+    _flusher = None
+
+    def __init__(self, path, group_size=64, group_interval=0.05, durable=False):
+        # A background flusher commits whatever is buffered every group_interval. With durable=True, append()
+        # also waits until its record has been fsynced, so a command never runs ahead of its log record.
+        self._path = path
+        self._file = open(path, 'ab')
+        self._keys = {}
+        self._buffer = bytearray()
+        self._group_size = group_size
+        self._group_interval = group_interval
+        self._durable = durable
+        self._condition = threading.Condition()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def register(self, key, receiver):
+        self._keys[id(receiver)] = key
+
+    def append(self, command: Command, undone=False):
+        key = self._keys.get(id(command.receiver()))
+        if key is None:
+            raise ValueError('Receiver ' + repr(command.receiver()) + ' was never registered with the journal')
+        key = key.encode('utf-8')
+        opcode = self._COMMANDS.index(type(command)) + 1
+        with self._condition:
+            self._buffer += self._HEADER.pack(opcode, undone, len(key)) + key
+            self._buffered += 1
+            self._appended += 1
+            sequence = self._appended
+            if self._buffered >= self._group_size:
+                self._commit_locked()
+            elif self._durable:
+                self._condition.wait_for(lambda: self._committed >= sequence)
+
+    def commit(self):
+        with self._condition:
+            self._commit_locked()
+
+    def close(self):
+        with self._condition:
+            self._commit_locked()
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+        self._file.close()
+
+    def _commit_locked(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer = bytearray()
+            self._buffered = 0
+        self._committed = self._appended
+        self._condition.notify_all()
+
+    def _flush_periodically(self):
+        with self._condition:
+            while not self._closed:
+                self._condition.wait(self._group_interval)
+                if not self._closed:
+                    self._commit_locked()
+
+    def compact(self):
+        # Turning a bulb on or off only depends on the last command, so one record per receiver is enough
+        with self._condition:
+            self._commit_locked()
+            self._compact_locked()
+
+    def _compact_locked(self):
+        latest = self._latest(self._path)
+        compacted_path = self._path + '.compact'
+        with open(compacted_path, 'wb') as compacted:
+            for key, (opcode, undone) in latest.items():
+                key = key.encode('utf-8')
+                compacted.write(self._HEADER.pack(opcode, undone, len(key)) + key)
+            compacted.flush()
+            os.fsync(compacted.fileno())
+        self._file.close()
+        os.replace(compacted_path, self._path)
+        self._file = open(self._path, 'ab')
+
+    @classmethod
+    def replay(cls, path, receivers):
+        for key, (opcode, undone) in cls._latest(path).items():
+            command = cls._COMMANDS[opcode - 1](receivers[key])
+            if undone:
+                command.undo()
+            else:
+                command.execute()
+
+    @classmethod
+    def _latest(cls, path):
+        latest = {}
+        with open(path, 'rb') as journal:
+            data = journal.read()
+        offset = 0
+        while offset + cls._HEADER.size <= len(data):
+            opcode, undone, key_length = cls._HEADER.unpack_from(data, offset)
+            offset += cls._HEADER.size
+            if offset + key_length > len(data):
+                break  # Torn write from a crash mid-commit
+            key = data[offset:offset + key_length].decode('utf-8')
+            offset += key_length
+            latest.pop(key, None)
+            latest[key] = (opcode, undone)
+        return latest
+
 
 class RemoteControl:
+    _queued = False
+    _batch_size = None
+    _pending = None
+    _history = None
+    _redoable = None
+    _journal = None
+
+    def __init__(self, queued=False, batch_size=64, history_size=100, journal: CommandJournal = None):
+        self._queued = queued
+        self._batch_size = batch_size
+        self._pending = []
+        self._history = deque(maxlen=history_size)
+        self._redoable = deque(maxlen=history_size)
+        self._journal = journal
+
     def submit(self, command: Command):
+        if not self._queued:
+            self._run(command)
+            return
+        self._pending.append(command)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        pending = self._pending
+        self._pending = []
+
+        # Walking backwards, a coalescing command is dropped when a later coalescing command for the same receiver
+        # overrides it before any other command touches that receiver; everything else runs in order
+        kept = []
+        overridden = set()
+        for command in reversed(pending):
+            receiver = command.receiver()
+            if receiver is not None:
+                if not command.coalesces:
+                    overridden.discard(id(receiver))
+                elif id(receiver) in overridden:
+                    continue
+                else:
+                    overridden.add(id(receiver))
+            kept.append(command)
+
+        for command in reversed(kept):
+            self._run(command)
+
+    def undo(self):
+        self.flush()
+        if not self._history:
+            return
+        command = self._history.pop()
+        if self._journal:
+            self._journal.append(command, undone=True)
+        command.undo()
+        self._redoable.append(command)
+
+    def redo(self):
+        self.flush()
+        if not self._redoable:
+            return
+        command = self._redoable.pop()
+        if self._journal:
+            self._journal.append(command)
+        command.redo()
+        self._history.append(command)
+
+    def _run(self, command: Command):
+        if self._journal:
+            self._journal.append(command)
+        self._execute(command)
+        self._history.append(command)
+        self._redoable.clear()
+
+    def _execute(self, command: Command):
         command.execute()
 
 
+class ParallelRemoteControl(RemoteControl):
+    _queues = None
+    _workers = None
+    _metrics_lock = None
+    _completed = 0
+    _failed = 0
+    _total_latency = 0.0
+    _max_latency = 0.0
+    _shards = None
+    _shards_lock = None
+    _next_shard = 0
+    _errors = None
+
+    def __init__(self, workers=4, queue_size=1024, **options):
+        super().__init__(**options)
+        # Commands for one receiver always land on the same worker, which keeps them in order
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._workers = [threading.Thread(target=self._work, args=(commands,), daemon=True) for commands in self._queues]
+        self._metrics_lock = threading.Lock()
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._errors = deque(maxlen=100)
+        for worker in self._workers:
+            worker.start()
+
+    def _execute(self, command: Command):
+        # Receivers are dealt out round-robin the first time they are seen and then stick to their shard
+        receiver = command.receiver()
+        with self._shards_lock:
+            shard = self._shards.get(id(receiver)) if receiver is not None else None
+            if shard is None:
+                shard = self._next_shard
+                self._next_shard = (shard + 1) % len(self._queues)
+                if receiver is not None:
+                    self._shards[id(receiver)] = shard
+        self._queues[shard].put((command, time.perf_counter()))  # Blocks while the worker is behind
+
+    def _work(self, commands):
+        while True:
+            item = commands.get()
+            if item is None:
+                commands.task_done()
+                return
+            command, submitted_at = item
+            failed = False
+            try:
+                command.execute()
+            except Exception as error:
+                failed = True
+                self._errors.append((command, error))
+            latency = time.perf_counter() - submitted_at
+            with self._metrics_lock:
+                self._completed += 1
+                self._failed += failed
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+            commands.task_done()
+
+    def join(self):
+        self.flush()
+        for commands in self._queues:
+            commands.join()
+
+    def undo(self):
+        self.join()
+        super().undo()
+
+    def redo(self):
+        self.join()
+        super().redo()
+
+    def shutdown(self):
+        self.join()
+        for commands in self._queues:
+            commands.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def queue_depth(self):
+        return sum(commands.qsize() for commands in self._queues)
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                'queue_depth': self.queue_depth(),
+                'completed': self._completed,
+                'failed': self._failed,
+                'average_latency': self._total_latency / self._completed if self._completed else 0.0,
+                'max_latency': self._max_latency,
+                'last_error': self._errors[-1] if self._errors else None,
+            }
+
+    def errors(self):
+        return list(self._errors)
+
+
 if __name__ == '__main__':
     bulb = Bulb()
 
@@ -63,3 +386,31 @@ if __name__ == '__main__':
     remote = RemoteControl()
     remote.submit(turnOn)  # Bulb has been lit!
     remote.submit(turnOff)  # Darkness!
+
+    queuedRemote = RemoteControl(queued=True)
+    queuedRemote.submit(turnOn)
+    queuedRemote.submit(turnOff)
+    queuedRemote.submit(turnOn)
+    queuedRemote.flush()  # Bulb has been lit!
+    queuedRemote.undo()  # Darkness!
+    queuedRemote.redo()  # Bulb has been lit!
+
+    import tempfile
+    journalPath = os.path.join(tempfile.mkdtemp(), 'remote.journal')
+    journal = CommandJournal(journalPath)
+    journal.register('hallway', bulb)
+    journaledRemote = RemoteControl(journal=journal)
+    journaledRemote.submit(turnOff)  # Darkness!
+    journaledRemote.submit(turnOn)  # Bulb has been lit!
+    journal.compact()
+    journal.close()
+
+    rebuiltBulb = Bulb()
+    CommandJournal.replay(journalPath, {'hallway': rebuiltBulb})  # Bulb has been lit!
+    print(rebuiltBulb.is_lit())  # True
+
+    parallelRemote = ParallelRemoteControl(workers=2)
+    parallelRemote.submit(turnOff)  # Darkness!
+    parallelRemote.submit(turnOn)  # Bulb has been lit!
+    parallelRemote.shutdown()
+    print(parallelRemote.metrics())
@@ -1,3 +1,13 @@
+import mmap
+import os
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain
+
+
 class RadioStation:
     _frequency = None
 
@@ -8,22 +18,226 @@ class RadioStation:
         return self._frequency
 
 class StationList:
-    _stations = []
+    _chunkSize = 1024
+    _typecode = 'q'
+    _state = None
+    _pending = None
+    _lock = None
+    _version = 0
     _counter = 0
 
+    def __init__(self):
+        # _state is (sorted frequency chunks, last frequency of each chunk, size). Published chunks are never
+        # mutated, so a reader that grabbed _state keeps a consistent snapshot while writers swap in a new one.
+        # Frequencies stay in an integer column until the first non-integer frequency widens it to float64.
+        self._state = ((), array(self._typecode), 0)
+        self._pending = array(self._typecode)
+        self._lock = threading.Lock()
+
     def addStation(self, station):
-        self._stations.append(station)
+        frequency = station.getFrequency()
+        with self._lock:
+            if self._typecode == 'q' and not isinstance(frequency, int):
+                self._widen()
+            self._pending.append(frequency)
 
     def removeStation(self, toRemove):
         toRemoveFrequency = toRemove.getFrequency()
-        self._stations = filter(lambda station: station.getFrequency() != toRemoveFrequency, self._stations)
+        with self._lock:
+            self._mergePending()
+            chunks, lasts, size = self._state
+            chunks = list(chunks)
+            index = bisect_left(lasts, toRemoveFrequency)
+            removed = 0
+            while index < len(chunks) and chunks[index][0] <= toRemoveFrequency:
+                chunk = chunks[index]
+                kept = array(self._typecode, (frequency for frequency in chunk if frequency != toRemoveFrequency))
+                removed += len(chunk) - len(kept)
+                if kept:
+                    chunks[index] = kept
+                    index += 1
+                else:
+                    del chunks[index]
+            if removed:
+                self._publish(chunks, size - removed)
+
+    def getStation(self, frequency):
+        chunks, lasts, _ = self._snapshot()
+        index = bisect_left(lasts, frequency)
+        if index < len(chunks):
+            chunk = chunks[index]
+            position = bisect_left(chunk, frequency)
+            if position < len(chunk) and chunk[position] == frequency:
+                return RadioStation(frequency)
+        return None
+
+    def stationsBetween(self, low, high):
+        chunks, lasts, _ = self._snapshot()
+        return self._stations(chunks, bisect_left(lasts, low), low, high)
+
+    def getVersion(self):
+        return self._version
+
+    def _stations(self, chunks, index, low, high):
+        while index < len(chunks):
+            chunk = chunks[index]
+            if chunk[0] > high:
+                return
+            for frequency in chunk[bisect_left(chunk, low):bisect_right(chunk, high)]:
+                yield RadioStation(frequency)
+            index += 1
+
+    def _allStations(self, chunks):
+        for chunk in chunks:
+            for frequency in chunk:
+                yield RadioStation(frequency)
+
+    def _snapshot(self):
+        if self._pending:
+            with self._lock:
+                self._mergePending()
+        return self._state
+
+    def _mergePending(self):
+        if not self._pending:
+            return
+        pending = sorted(self._pending)
+        self._pending = array(self._typecode)
+        chunks, lasts, size = self._state
+        chunkSize = self._chunkSize
+
+        if len(pending) * 8 > size:
+            merged = array(self._typecode, sorted(chain(chain.from_iterable(chunks), pending)))
+            chunks = [merged[start:start + chunkSize] for start in range(0, len(merged), chunkSize)]
+            self._publish(chunks, len(merged))
+            return
+
+        # Copy only the chunks that receive new stations
+        chunks = list(chunks)
+        lasts = list(lasts)
+        owned = set()
+        for frequency in pending:
+            index = min(bisect_left(lasts, frequency), len(chunks) - 1)
+            chunk = chunks[index]
+            if id(chunk) not in owned:
+                chunk = chunks[index] = array(self._typecode, chunk)
+                owned.add(id(chunk))
+            insort(chunk, frequency)
+            lasts[index] = chunk[-1]
+            if len(chunk) > 2 * chunkSize:
+                halves = [chunk[:chunkSize], chunk[chunkSize:]]
+                chunks[index:index + 1] = halves
+                lasts[index:index + 1] = [half[-1] for half in halves]
+                owned.update(id(half) for half in halves)
+        self._publish(chunks, size + len(pending))
+
+    def _widen(self):
+        self._typecode = 'd'
+        self._pending = array('d', self._pending)
+        chunks, _, size = self._state
+        self._publish([array('d', chunk) for chunk in chunks], size)
+
+    def _publish(self, chunks, size):
+        self._state = (tuple(chunks), array(self._typecode, (chunk[-1] for chunk in chunks)), size)
+        self._version += 1
+
+    def __len__(self):
+        return self._snapshot()[2]
 
     def __iter__(self):
-        return iter(self._stations)
+        return self._allStations(self._snapshot()[0])
 
     def next(self):
         self._counter += 1
 
+
+class MappedStationList:
+    # Read-only catalog of native-endian float64 frequencies, one fixed-width record per station
+    _file = None
+    _map = None
+    _frequencies = None
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._frequencies = memoryview(self._map).cast('d')
+        else:
+            self._frequencies = memoryview(array('d'))
+
+    @staticmethod
+    def writeCatalog(path, stations, batchSize=65536):
+        with open(path, 'wb') as catalog:
+            batch = array('d')
+            for station in stations:
+                batch.append(station.getFrequency())
+                if len(batch) >= batchSize:
+                    batch.tofile(catalog)
+                    batch = array('d')
+            batch.tofile(catalog)
+
+    def iter_chunks(self, size):
+        frequencies = self._frequencies
+        for start in range(0, len(frequencies), size):
+            yield [RadioStation(frequency) for frequency in frequencies[start:start + size]]
+
+    def scan(self, predicate):
+        for frequency in self._frequencies:
+            if predicate(frequency):
+                yield RadioStation(frequency)
+
+    def close(self):
+        self._frequencies.release()
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self._frequencies)
+
+    def __iter__(self):
+        for frequency in self._frequencies:
+            yield RadioStation(frequency)
+
+
+def benchmark_snapshot_reads(stations=100000, writers=2, seconds=1.0):
+    stationList = StationList()
+    for _ in range(stations):
+        stationList.addStation(RadioStation(random.uniform(80, 110)))
+    len(stationList)
+
+    stop = threading.Event()
+    writes = [0] * writers
+
+    def writer(slot):
+        while not stop.is_set():
+            frequency = random.uniform(80, 110)
+            stationList.addStation(RadioStation(frequency))
+            stationList.removeStation(RadioStation(frequency))
+            writes[slot] += 2
+
+    threads = [threading.Thread(target=writer, args=(slot,)) for slot in range(writers)]
+    for thread in threads:
+        thread.start()
+
+    read = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        previous = float('-inf')
+        for station in stationList:
+            assert station.getFrequency() >= previous
+            previous = station.getFrequency()
+            read += 1
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(str(int(read / elapsed)) + ' stations read/s alongside ' + str(int(sum(writes) / elapsed))
+          + ' writes/s from ' + str(writers) + ' writer threads')
+
+
 if __name__ == '__main__':
     stationList = StationList()
 
@@ -39,3 +253,18 @@ if __name__ == '__main__':
 
     for station in stationList:
         print(station.getFrequency())
+
+    for station in stationList.stationsBetween(88, 102):
+        print(station.getFrequency())
+
+    benchmark_snapshot_reads()
+
+    import tempfile
+    catalogPath = os.path.join(tempfile.mkdtemp(), 'stations.bin')
+    MappedStationList.writeCatalog(catalogPath, [RadioStation(89), RadioStation(101), RadioStation(102)])
+    catalog = MappedStationList(catalogPath)
+    for chunk in catalog.iter_chunks(2):
+        print([station.getFrequency() for station in chunk])
+    for station in catalog.scan(lambda frequency: frequency > 100):
+        print(station.getFrequency())
+    catalog.close()
@@ -1,4 +1,17 @@
+import datetime
+import multiprocessing
+import sys
+import threading
+import time
+from collections import deque
+from itertools import islice
+from zlib import crc32
+
+
 class ChatRoomMediator:
+    def join(self, user):
+        pass
+
     def showMessage(self, user, message):
         pass
 
@@ -11,6 +24,174 @@ class ChatRoom(ChatRoomMediator):
         print(str(time) + '[' + sender + ']: ' + message)
 
 
+class BroadcastChatRoom(ChatRoomMediator):
+    _batchSize = None
+    _pending = None
+    _batches = None
+    _nextBatch = 0
+    _cursors = None
+    _lock = None
+
+    def __init__(self, batchSize=1024, capacity=256):
+        # Every member reads the same bounded ring of stamped batches through its own cursor, so a send is a
+        # single append and a member that falls more than `capacity` batches behind loses the oldest ones
+        self._batchSize = batchSize
+        self._pending = []
+        self._batches = deque(maxlen=capacity)
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def join(self, user):
+        with self._lock:
+            self._cursors[id(user)] = self._nextBatch
+
+    def showMessage(self, user, message):
+        # The pending list is only touched under the lock, so a published batch is never appended to again
+        with self._lock:
+            self._pending.append((user.getName(), message))
+            if len(self._pending) >= self._batchSize:
+                self._publish()
+
+    def flush(self):
+        with self._lock:
+            self._publish()
+
+    def _publish(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._batches.append((str(datetime.datetime.now()), pending))
+        self._nextBatch += 1
+
+    def drain(self, user, writer=None):
+        # Whatever is still pending is published first, so a quiet room does not wait on a full batch
+        with self._lock:
+            self._publish()
+            firstBatch = self._nextBatch - len(self._batches)
+            cursor = max(self._cursors[id(user)], firstBatch)
+            batches = list(islice(self._batches, cursor - firstBatch, None))
+            self._cursors[id(user)] = self._nextBatch
+
+        lines = []
+        for stamp, messages in batches:
+            prefix = stamp + '['
+            lines.extend(prefix + sender + ']: ' + message + '\n' for sender, message in messages)
+        (writer or sys.stdout).write(''.join(lines))
+        return len(lines)
+
+
+def _serveShard(inbox, replies, results, capacity):
+    histories = {}
+    counts = {}
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            results.put(counts)
+            return
+        if isinstance(batch, tuple):
+            # ('drain', roomId): hand back everything the room has buffered since the last drain
+            _, roomId = batch
+            history = histories.pop(roomId, ())
+            replies.put(list(history))
+            continue
+        stamp = str(datetime.datetime.now())
+        for roomId, sender, message in batch:
+            history = histories.get(roomId)
+            if history is None:
+                history = histories[roomId] = deque(maxlen=capacity)
+            history.append(stamp + '[' + sender + ']: ' + message)
+            counts[roomId] = counts.get(roomId, 0) + 1
+
+
+class ShardedRoom(ChatRoomMediator):
+    _registry = None
+    _roomId = None
+
+    def __init__(self, registry, roomId):
+        self._registry = registry
+        self._roomId = roomId
+
+    def showMessage(self, user, message):
+        self._registry.route(self._roomId, user.getName(), message)
+
+    def drain(self, writer=None):
+        lines = self._registry.drain(self._roomId)
+        if lines:
+            (writer or sys.stdout).write('\n'.join(lines) + '\n')
+        return len(lines)
+
+
+class ChatRoomRegistry:
+    _inboxes = None
+    _outboxes = None
+    _outboxLocks = None
+    _replies = None
+    _results = None
+    _workers = None
+    _batchSize = None
+
+    def __init__(self, workers=None, batchSize=4096, capacity=1024):
+        workers = workers or multiprocessing.cpu_count()
+        self._inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        self._outboxes = [[] for _ in range(workers)]
+        self._outboxLocks = [threading.Lock() for _ in range(workers)]
+        self._replies = [multiprocessing.Queue() for _ in range(workers)]
+        self._results = multiprocessing.Queue()
+        self._batchSize = batchSize
+        self._workers = [multiprocessing.Process(target=_serveShard, args=(inbox, replies, self._results, capacity),
+                                                 daemon=True)
+                         for inbox, replies in zip(self._inboxes, self._replies)]
+        for worker in self._workers:
+            worker.start()
+
+    def room(self, roomId):
+        return ShardedRoom(self, roomId)
+
+    def shardOf(self, roomId):
+        # crc32 rather than hash() so every process agrees on which shard owns a room
+        return crc32(roomId.encode('utf-8')) % len(self._inboxes)
+
+    def route(self, roomId, sender, message):
+        # An outbox is appended to, handed off and replaced under its shard's lock, so no sender can add to a
+        # list that has already been queued
+        shard = self.shardOf(roomId)
+        with self._outboxLocks[shard]:
+            outbox = self._outboxes[shard]
+            outbox.append((roomId, sender, message))
+            if len(outbox) >= self._batchSize:
+                self._sendOutbox(shard)
+
+    def flush(self):
+        for shard, lock in enumerate(self._outboxLocks):
+            with lock:
+                self._sendOutbox(shard)
+
+    def drain(self, roomId):
+        # The request follows the room's buffered messages down the same queue, so it sees all of them; the lock
+        # is held until the reply arrives so concurrent drains on one shard cannot take each other's replies
+        shard = self.shardOf(roomId)
+        with self._outboxLocks[shard]:
+            self._sendOutbox(shard)
+            self._inboxes[shard].put(('drain', roomId))
+            return self._replies[shard].get()
+
+    def _sendOutbox(self, shard):
+        if self._outboxes[shard]:
+            self._inboxes[shard].put(self._outboxes[shard])
+            self._outboxes[shard] = []
+
+    def close(self):
+        self.flush()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        counts = {}
+        for _ in self._workers:
+            counts.update(self._results.get())
+        for worker in self._workers:
+            worker.join()
+        return counts
+
+
 class User:
     _name = None
     _chatMediator = None
@@ -18,6 +199,9 @@ class User:
     def __init__(self, name, chatMediator):
         self.name = name
         self._chatMediator = chatMediator
+        join = getattr(chatMediator, 'join', None)
+        if join:
+            join(self)
 
     def getName(self):
         return self.name
@@ -25,6 +209,44 @@ class User:
     def send(self, message):
         self._chatMediator.showMessage(self, message)
 
+def benchmark_broadcast(users=4, messages=1000000):
+    import io
+
+    room = BroadcastChatRoom(capacity=messages // 1024 + 1)
+    members = [User('User ' + str(number), room) for number in range(users)]
+    sender = members[0]
+
+    started = time.perf_counter()
+    for _ in range(messages):
+        sender.send('ping')
+    room.flush()
+    sent = time.perf_counter() - started
+
+    started = time.perf_counter()
+    delivered = sum(room.drain(member, io.StringIO()) for member in members)
+    drained = time.perf_counter() - started
+
+    print(str(int(messages / sent)) + ' messages/s sent, ' + str(int(delivered / drained)) + ' deliveries/s drained')
+
+def benchmark_sharded_rooms(maxWorkers=None, rooms=64, messages=500000):
+    import io
+
+    roomIds = ['room-' + str(number) for number in range(rooms)]
+    for workers in range(1, (maxWorkers or multiprocessing.cpu_count()) + 1):
+        registry = ChatRoomRegistry(workers, capacity=messages // rooms + 1)
+        shardedRooms = [registry.room(roomId) for roomId in roomIds]
+        senders = [User('User ' + roomId, room) for roomId, room in zip(roomIds, shardedRooms)]
+
+        started = time.perf_counter()
+        for number in range(messages):
+            senders[number % rooms].send('ping')
+        delivered = sum(room.drain(io.StringIO()) for room in shardedRooms)
+        counts = registry.close()
+        elapsed = time.perf_counter() - started
+
+        assert delivered == sum(counts.values()) == messages
+        print(str(workers) + ' workers: ' + str(int(messages / elapsed)) + ' messages/s')
+
 if __name__ == '__main__':
     mediator = ChatRoom()
 
@@ -32,4 +254,15 @@ if __name__ == '__main__':
     jane = User('Jane Doe', mediator)
 
     john.send('Hi There!')
-    jane.send('Hey!')
\ No newline at end of file
+    jane.send('Hey!')
+
+    broadcastRoom = BroadcastChatRoom()
+    john = User('John Doe', broadcastRoom)
+    jane = User('Jane Doe', broadcastRoom)
+
+    john.send('Hi There!')
+    jane.send('Hey!')
+    broadcastRoom.drain(jane)
+
+    benchmark_broadcast()
+    benchmark_sharded_rooms()
@@ -1,26 +1,182 @@
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+
+def joinPieces(piece):
+    texts = []
+    while piece:
+        piece, text = piece
+        texts.append(text)
+    return ''.join(reversed(texts))
+
 class EditorMemento:
-    _content = None
+    _piece = None
 
     def __init__(self, content):
-        self.content = content
+        self._piece = (None, content) if content else None
+
+    @classmethod
+    def fromPiece(cls, piece):
+        memento = cls('')
+        memento._piece = piece
+        return memento
+
+    def getPiece(self):
+        return self._piece
 
     def getContent(self):
-        return self.content
+        return joinPieces(self._piece)
 
 class Editor:
-    _content = ''
+    # Content is a chain of (previous piece, text) pairs; typing adds one pair and mementos share the chain
+    _piece = None
+    _rendered = (None, '')
 
     def type(self, words):
-        self._content = self._content + ' ' + words
+        self._piece = (self._piece, ' ' + words)
 
     def getContent(self):
-       return self._content
+        if self._rendered[0] is not self._piece:
+            self._rendered = (self._piece, joinPieces(self._piece))
+        return self._rendered[1]
 
     def save(self):
-        return EditorMemento(self._content)
+        return EditorMemento.fromPiece(self._piece)
 
     def restore(self, memento):
-        self.content = memento.getContent()
+        self._piece = memento.getPiece()
+
+def commonPrefixLength(first, second):
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+class EditorHistory:
+    # Every keyframeInterval-th save stores the full text; the rest store a delta against that keyframe,
+    # so restoring any point reads at most one keyframe and one delta. The history file starts with a header
+    # holding the keyframe interval, followed by length-prefixed records in save order, so reopening the same
+    # path picks the history up where the last process left it.
+    _FILE_HEADER = struct.Struct('<4sI')
+    _MAGIC = b'EDH1'
+    _RECORD_HEADER = struct.Struct('<I')
+    _DELTA_HEADER = struct.Struct('<Q')
+
+    _editor = None
+    _keyframeInterval = None
+    _memoryBudget = None
+    _entries = None
+    _spilled = 0
+    _inMemory = 0
+    _file = None
+    _map = None
+    _lastKeyframe = None
+
+    def __init__(self, editor, path, keyframeInterval=32, memoryBudget=1 << 20):
+        self._editor = editor
+        self._keyframeInterval = keyframeInterval
+        self._memoryBudget = memoryBudget
+        self._entries = []
+        self._file = open(path, 'a+b')
+        self._load()
+
+    def save(self):
+        content = self._editor.save().getContent().encode('utf-8')
+        index = len(self._entries)
+        if index % self._keyframeInterval == 0:
+            self._lastKeyframe = content
+            record = b'K' + content
+        else:
+            if self._lastKeyframe is None:
+                self._lastKeyframe = self._read(index - index % self._keyframeInterval)[1:]
+            sharedLength = commonPrefixLength(self._lastKeyframe, content)
+            record = b'D' + self._DELTA_HEADER.pack(sharedLength) + content[sharedLength:]
+        record = zlib.compress(record, 1)
+        self._entries.append(record)
+        self._inMemory += len(record)
+        if self._inMemory > self._memoryBudget:
+            self._spill(self._inMemory - self._memoryBudget)
+        return index
+
+    def restore(self, index):
+        if index < 0:
+            index += len(self._entries)
+        if not 0 <= index < len(self._entries):
+            raise IndexError('No saved state at index ' + str(index))
+        record = self._read(index)
+        if record[:1] == b'K':
+            content = record[1:]
+        else:
+            keyframe = self._read(index - index % self._keyframeInterval)[1:]
+            sharedLength, = self._DELTA_HEADER.unpack_from(record, 1)
+            content = keyframe[:sharedLength] + record[1 + self._DELTA_HEADER.size:]
+        self._editor.restore(EditorMemento(content.decode('utf-8')))
+
+    def close(self):
+        self._spill(self._inMemory)
+        os.fsync(self._file.fileno())
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        self._file.seek(0)
+        data = self._file.read()
+        if not data:
+            self._file.write(self._FILE_HEADER.pack(self._MAGIC, self._keyframeInterval))
+            self._file.flush()
+            return
+        magic, self._keyframeInterval = self._FILE_HEADER.unpack_from(data)
+        if magic != self._MAGIC:
+            raise ValueError('Not an editor history file')
+        offset = self._FILE_HEADER.size
+        while offset + self._RECORD_HEADER.size <= len(data):
+            length, = self._RECORD_HEADER.unpack_from(data, offset)
+            if offset + self._RECORD_HEADER.size + length > len(data):
+                break
+            self._entries.append((offset + self._RECORD_HEADER.size, length))
+            offset += self._RECORD_HEADER.size + length
+        self._spilled = len(self._entries)
+        self._file.truncate(offset)  # Drops a torn record left by a crash mid-spill
+
+    def _spill(self, budgetExcess):
+        # Oldest records move to the append-only file first
+        self._file.seek(0, os.SEEK_END)
+        position = self._file.tell()
+        spilled = []
+        while budgetExcess > 0 and self._spilled < len(self._entries):
+            record = self._entries[self._spilled]
+            spilled.append(self._RECORD_HEADER.pack(len(record)))
+            spilled.append(record)
+            position += self._RECORD_HEADER.size
+            self._entries[self._spilled] = (position, len(record))
+            position += len(record)
+            self._inMemory -= len(record)
+            budgetExcess -= len(record)
+            self._spilled += 1
+        self._file.write(b''.join(spilled))
+        self._file.flush()
+
+    def _read(self, index):
+        entry = self._entries[index]
+        if isinstance(entry, bytes):
+            return zlib.decompress(entry)
+        offset, length = entry
+        if self._map is None or len(self._map) < offset + length:
+            if self._map:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return zlib.decompress(self._map[offset:offset + length])
 
 editor = Editor()
 editor.type('This is the first sentence')
@@ -33,4 +189,13 @@ editor.type('And this is the third')
 print(editor.getContent())  # This is the first sentence. This is second. And this is third.
 
 editor.restore(saved)
-editor.getContent() # This is the first sentence. This is second.
\ No newline at end of file
+editor.getContent() # This is the first sentence. This is second.
+
+if __name__ == '__main__':
+    history = EditorHistory(editor, os.path.join(tempfile.mkdtemp(), 'editor.history'), memoryBudget=64)
+    first = history.save()
+    editor.type('And this is the third')
+    history.save()
+    history.restore(first)
+    print(editor.getContent())  # This is the first sentence. This is second.
+    history.close()
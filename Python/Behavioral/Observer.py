@@ -1,3 +1,18 @@
+import asyncio
+import inspect
+import multiprocessing
+import os
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
 class JobPost:
     _title = None
 
@@ -17,19 +32,549 @@ class JobSeeker:
         print('Hi ' + self.name + '! New job posted: ' + job.getTitle())
 
 
+def titleTokens(title):
+    return set(re.findall(r'\w+', title.lower()))
+
+
+def deliverJobs(observer, jobPostings):
+    onJobsPosted = getattr(observer, 'onJobsPosted', None)
+    if onJobsPosted:
+        onJobsPosted(jobPostings)
+    else:
+        for jobPosting in jobPostings:
+            observer.onJobPosted(jobPosting)
+
+
 class EmploymentAgency:
-    _observers = []
+    _observers = None
+    _index = None
+    _everything = None
+
+    def __init__(self):
+        # Subscriptions are numbered in attach order; _index maps a title token to the subscriptions that asked for it
+        self._observers = []
+        self._index = {}
+        self._everything = set()
 
     def notify(self, jobPosting):
-        for observer in self._observers:
-            observer.onJobPosted(jobPosting)
+        for subscription in self._matches(jobPosting):
+            self._deliver(subscription, [jobPosting])
 
-    def attach(self, observer):
-        self._observers.append(observer)
+    def attach(self, observer, keywords=None, predicate=None):
+        # A keyword matches when all of its tokens appear in the title; each one is indexed under its first token
+        subscription = len(self._observers)
+        keywordTokens = None
+        if keywords is not None:
+            keywordTokens = [tokens for tokens in map(titleTokens, keywords) if tokens]
+        self._observers.append((observer, predicate, keywordTokens))
+        if keywordTokens is None:
+            self._everything.add(subscription)
+        else:
+            for tokens in keywordTokens:
+                self._index.setdefault(min(tokens), set()).add(subscription)
 
     def addJob(self, jobPosting):
         self.notify(jobPosting)
 
+    def addJobs(self, jobPostings):
+        deliveries = self._group(jobPostings)
+        for subscription in sorted(deliveries):
+            self._deliver(subscription, deliveries[subscription])
+
+    def _deliver(self, subscription, jobPostings):
+        deliverJobs(self._observers[subscription][0], jobPostings)
+
+    def _group(self, jobPostings):
+        deliveries = {}
+        for jobPosting in jobPostings:
+            for subscription in self._matches(jobPosting):
+                deliveries.setdefault(subscription, []).append(jobPosting)
+        return deliveries
+
+    def _matches(self, jobPosting):
+        candidates = set(self._everything)
+        postedTokens = titleTokens(jobPosting.getTitle())
+        for token in postedTokens:
+            candidates.update(self._index.get(token, ()))
+
+        matches = []
+        for subscription in sorted(candidates):
+            _, predicate, keywordTokens = self._observers[subscription]
+            if keywordTokens is not None and not any(tokens <= postedTokens for tokens in keywordTokens):
+                continue
+            if predicate is None or predicate(jobPosting):
+                matches.append(subscription)
+        return matches
+
+
+class Mailbox:
+    _capacity = None
+    _policy = None
+    _items = None
+    _sequence = 0
+    _createdAt = None
+    delivered = 0
+    dropped = 0
+    failed = 0
+
+    def __init__(self, capacity, policy):
+        if policy not in ('drop-oldest', 'block', 'coalesce'):
+            raise ValueError('Unknown overflow policy: ' + policy)
+        self._capacity = capacity
+        self._policy = policy
+        self._items = OrderedDict()
+        self._createdAt = time.monotonic()
+
+    def offer(self, jobPosting):
+        # Returns False only under the block policy, when the caller has to wait for room
+        now = time.monotonic()
+        if self._policy == 'coalesce':
+            key = jobPosting.getTitle()
+            if key in self._items:
+                self._items[key] = (jobPosting, self._items[key][1])
+                return True
+        else:
+            key = self._sequence
+            self._sequence += 1
+
+        if len(self._items) >= self._capacity:
+            if self._policy == 'block':
+                return False
+            self._items.popitem(last=False)
+            self.dropped += 1
+        self._items[key] = (jobPosting, now)
+        return True
+
+    def take(self, limit):
+        batch = []
+        while self._items and len(batch) < limit:
+            batch.append(self._items.popitem(last=False)[1][0])
+        return batch
+
+    def metrics(self):
+        now = time.monotonic()
+        oldest = next(iter(self._items.values()))[1] if self._items else now
+        return {
+            'pending': len(self._items),
+            'lag': now - oldest,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'throughput': self.delivered / max(now - self._createdAt, 1e-9),
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ThreadMailbox(Mailbox):
+    condition = None
+    scheduled = False
+
+    def __init__(self, capacity, policy):
+        super().__init__(capacity, policy)
+        self.condition = threading.Condition()
+
+
+class AsyncMailbox(Mailbox):
+    ready = None
+    space = None
+    idle = None
+
+    def __init__(self, capacity, policy):
+        super().__init__(capacity, policy)
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+class DispatchingEmploymentAgency(EmploymentAgency):
+    # Observers are held weakly. A collected observer's subscription is only queued for removal by the GC
+    # callback, which can fire on any thread; the index itself is only changed under _indexLock by _reap().
+    _mailboxType = Mailbox
+    _mailboxes = None
+    _capacity = None
+    _policy = None
+    _batchSize = None
+    _indexLock = None
+    _dead = None
+
+    def __init__(self, capacity=1024, policy='drop-oldest', batchSize=64):
+        super().__init__()
+        self._mailboxes = {}
+        self._capacity = capacity
+        self._policy = policy
+        self._batchSize = batchSize
+        self._indexLock = threading.RLock()
+        self._dead = deque()
+
+    def attach(self, observer, keywords=None, predicate=None):
+        with self._indexLock:
+            self._reap()
+            subscription = len(self._observers)
+            self._mailboxes[subscription] = self._mailboxType(self._capacity, self._policy)
+            super().attach(weakref.ref(observer, lambda _: self._dead.append(subscription)), keywords, predicate)
+
+    def metrics(self):
+        return {subscription: mailbox.metrics() for subscription, mailbox in list(self._mailboxes.items())}
+
+    def _matches(self, jobPosting):
+        with self._indexLock:
+            self._reap()
+            return super()._matches(jobPosting)
+
+    def _reap(self):
+        while self._dead:
+            subscription = self._dead.popleft()
+            self._everything.discard(subscription)
+            for subscriptions in self._index.values():
+                subscriptions.discard(subscription)
+            self._retire(subscription, self._mailboxes.pop(subscription, None))
+
+    def _retire(self, subscription, mailbox):
+        pass
+
+
+class ThreadedEmploymentAgency(DispatchingEmploymentAgency):
+    _mailboxType = ThreadMailbox
+    _executor = None
+
+    def __init__(self, workers=4, capacity=1024, policy='drop-oldest', batchSize=64):
+        super().__init__(capacity, policy, batchSize)
+        self._executor = ThreadPoolExecutor(workers)
+
+    def join(self):
+        for mailbox in list(self._mailboxes.values()):
+            with mailbox.condition:
+                mailbox.condition.wait_for(lambda: not mailbox.scheduled)
+
+    def shutdown(self):
+        self.join()
+        self._executor.shutdown()
+
+    def _deliver(self, subscription, jobPostings):
+        mailbox = self._mailboxes.get(subscription)
+        if mailbox is None:
+            return
+        with mailbox.condition:
+            for jobPosting in jobPostings:
+                while not mailbox.offer(jobPosting):
+                    # Full under the block policy: make sure someone is draining before waiting for room
+                    self._schedule(subscription, mailbox)
+                    mailbox.condition.wait()
+            self._schedule(subscription, mailbox)
+
+    def _schedule(self, subscription, mailbox):
+        if not mailbox.scheduled:
+            mailbox.scheduled = True
+            self._executor.submit(self._drain, subscription, mailbox)
+
+    def _drain(self, subscription, mailbox):
+        # At most one drain per mailbox runs at a time, which keeps each observer's deliveries in order
+        while True:
+            with mailbox.condition:
+                batch = mailbox.take(self._batchSize)
+                if not batch:
+                    mailbox.scheduled = False
+                    mailbox.condition.notify_all()
+                    return
+                mailbox.condition.notify_all()
+            observer = self._observers[subscription][0]()
+            if observer is None:
+                continue
+            try:
+                deliverJobs(observer, batch)
+                mailbox.delivered += len(batch)
+            except Exception:
+                mailbox.failed += len(batch)
+            del observer
+
+
+class AsyncEmploymentAgency(DispatchingEmploymentAgency):
+    # addJob/addJobs are coroutines here; the inherited synchronous notify() still works from inside a running
+    # loop and queues its deliveries behind any earlier ones for the same subscription
+    _mailboxType = AsyncMailbox
+    _consumers = None
+    _queuedPuts = None
+
+    def __init__(self, capacity=1024, policy='drop-oldest', batchSize=64):
+        super().__init__(capacity, policy, batchSize)
+        self._consumers = {}
+        self._queuedPuts = {}
+
+    async def addJob(self, jobPosting):
+        for subscription in self._matches(jobPosting):
+            await self._put(subscription, [jobPosting])
+
+    async def addJobs(self, jobPostings):
+        deliveries = self._group(jobPostings)
+        for subscription in sorted(deliveries):
+            await self._put(subscription, deliveries[subscription])
+
+    async def join(self):
+        while self._queuedPuts:
+            await asyncio.gather(*self._queuedPuts.values())
+        for mailbox in list(self._mailboxes.values()):
+            await mailbox.idle.wait()
+
+    def close(self):
+        for consumer in self._consumers.values():
+            consumer.cancel()
+
+    def _deliver(self, subscription, jobPostings):
+        previous = self._queuedPuts.get(subscription)
+        queued = asyncio.ensure_future(self._putAfter(previous, subscription, jobPostings))
+        self._queuedPuts[subscription] = queued
+        queued.add_done_callback(lambda _: self._forgetPut(subscription, queued))
+
+    def _forgetPut(self, subscription, queued):
+        if self._queuedPuts.get(subscription) is queued:
+            del self._queuedPuts[subscription]
+
+    async def _putAfter(self, previous, subscription, jobPostings):
+        if previous:
+            await previous
+        await self._put(subscription, jobPostings)
+
+    async def _put(self, subscription, jobPostings):
+        mailbox = self._mailboxes.get(subscription)
+        if mailbox is None:
+            return
+        if subscription not in self._consumers:
+            self._consumers[subscription] = asyncio.ensure_future(self._consume(subscription, mailbox))
+        for jobPosting in jobPostings:
+            while not mailbox.offer(jobPosting):
+                mailbox.space.clear()
+                await mailbox.space.wait()
+            mailbox.idle.clear()
+            mailbox.ready.set()
+
+    async def _consume(self, subscription, mailbox):
+        while True:
+            batch = mailbox.take(self._batchSize)
+            mailbox.space.set()
+            if not batch:
+                mailbox.ready.clear()
+                mailbox.idle.set()
+                await mailbox.ready.wait()
+                continue
+            observer = self._observers[subscription][0]()
+            if observer is None:
+                continue
+            try:
+                onJobsPosted = getattr(observer, 'onJobsPosted', None)
+                if inspect.iscoroutinefunction(onJobsPosted):
+                    await onJobsPosted(batch)
+                elif onJobsPosted is None and inspect.iscoroutinefunction(observer.onJobPosted):
+                    for jobPosting in batch:
+                        await observer.onJobPosted(jobPosting)
+                else:
+                    # Plain observers run off the event loop so a slow one cannot stall the others
+                    await asyncio.to_thread(deliverJobs, observer, batch)
+                mailbox.delivered += len(batch)
+            except Exception:
+                mailbox.failed += len(batch)
+            del observer
+
+    def _retire(self, subscription, mailbox):
+        if mailbox:
+            mailbox.idle.set()
+        consumer = self._consumers.pop(subscription, None)
+        if consumer:
+            consumer.cancel()
+
+
+FRAME_HEADER = struct.Struct('<IQ')  # payload length, sequence number; an empty frame 0 ends the stream
+TITLE_LENGTH = struct.Struct('<H')
+ACK = struct.Struct('<Q')
+NO_KEYWORDS = 0xFFFFFFFF
+
+
+def receiveExactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed mid-frame')
+        data += chunk
+    return bytes(data)
+
+
+def encodeTitles(titles):
+    parts = []
+    for title in titles:
+        encoded = title.encode('utf-8')
+        parts.append(TITLE_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def decodeTitles(payload):
+    titles = []
+    offset = 0
+    while offset < len(payload):
+        length, = TITLE_LENGTH.unpack_from(payload, offset)
+        offset += TITLE_LENGTH.size
+        titles.append(payload[offset:offset + length].decode('utf-8'))
+        offset += length
+    return titles
+
+
+class RemoteSubscriber:
+    _connection = None
+    _pending = None
+    _frameSize = None
+    _window = None
+    _sequence = 0
+    _acknowledged = 0
+
+    def __init__(self, connection, frameSize, window):
+        self._connection = connection
+        self._pending = []
+        self._frameSize = frameSize
+        self._window = window
+
+    def onJobsPosted(self, jobPostings):
+        self._pending.extend(jobPosting.getTitle() for jobPosting in jobPostings)
+        if len(self._pending) >= self._frameSize:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        payload = encodeTitles(self._pending)
+        self._pending = []
+        self._sequence += 1
+        self._connection.sendall(FRAME_HEADER.pack(len(payload), self._sequence) + payload)
+        # Stop and wait for acknowledgements once too many frames are in flight
+        while self._sequence - self._acknowledged > self._window:
+            self._readAck()
+
+    def close(self):
+        self.flush()
+        self._connection.sendall(FRAME_HEADER.pack(0, 0))
+        while self._acknowledged < self._sequence:
+            self._readAck()
+        self._connection.close()
+
+    def abort(self):
+        self._pending = []
+        self._connection.close()
+
+    def _readAck(self):
+        self._acknowledged, = ACK.unpack(receiveExactly(self._connection, ACK.size))
+
+
+class SocketEmploymentAgency(EmploymentAgency):
+    _path = None
+    _listener = None
+    _remotes = None
+    _frameSize = None
+    _window = None
+
+    def __init__(self, path, frameSize=256, window=8):
+        super().__init__()
+        self._path = path
+        self._remotes = {}
+        self._frameSize = frameSize
+        self._window = window
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen()
+
+    def accept(self, count):
+        # Each subscriber opens with its keyword list, so remote seekers use the same token index as local ones
+        for _ in range(count):
+            connection, _ = self._listener.accept()
+            length, = struct.unpack('<I', receiveExactly(connection, 4))
+            keywords = None
+            if length != NO_KEYWORDS:
+                keywords = decodeTitles(receiveExactly(connection, length))
+            subscription = len(self._observers)
+            remote = RemoteSubscriber(connection, self._frameSize, self._window)
+            self._remotes[subscription] = remote
+            self.attach(remote, keywords)
+
+    def flush(self):
+        for subscription, remote in list(self._remotes.items()):
+            try:
+                remote.flush()
+            except OSError:
+                self._detach(subscription)
+
+    def close(self):
+        for subscription, remote in list(self._remotes.items()):
+            try:
+                remote.close()
+            except OSError:
+                self._detach(subscription)
+        self._listener.close()
+        os.unlink(self._path)
+
+    def _deliver(self, subscription, jobPostings):
+        # A subscriber that went away is dropped so the rest of the batch still reaches everyone else
+        try:
+            super()._deliver(subscription, jobPostings)
+        except OSError:
+            self._detach(subscription)
+
+    def _detach(self, subscription):
+        remote = self._remotes.pop(subscription, None)
+        if remote is None:
+            return
+        self._everything.discard(subscription)
+        for subscriptions in self._index.values():
+            subscriptions.discard(subscription)
+        remote.abort()
+
+
+def subscribeJobs(path, observer, keywords=None):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    if keywords is None:
+        connection.sendall(struct.pack('<I', NO_KEYWORDS))
+    else:
+        encoded = encodeTitles(keywords)
+        connection.sendall(struct.pack('<I', len(encoded)) + encoded)
+
+    with connection:
+        while True:
+            length, sequence = FRAME_HEADER.unpack(receiveExactly(connection, FRAME_HEADER.size))
+            if not length:
+                return
+            titles = decodeTitles(receiveExactly(connection, length))
+            deliverJobs(observer, [JobPost(title) for title in titles])
+            connection.sendall(ACK.pack(sequence))
+
+
+class CountingSeeker:
+    received = 0
+
+    def onJobsPosted(self, jobPostings):
+        self.received += len(jobPostings)
+
+
+def benchmark_socket_fanout(processCounts=(1, 8, 64), jobs=20000):
+    for processCount in processCounts:
+        path = os.path.join(tempfile.mkdtemp(), 'agency.sock')
+        agency = SocketEmploymentAgency(path)
+        subscribers = [multiprocessing.Process(target=subscribeJobs, args=(path, CountingSeeker()))
+                       for _ in range(processCount)]
+        for subscriber in subscribers:
+            subscriber.start()
+        agency.accept(processCount)
+
+        started = time.perf_counter()
+        agency.addJobs([JobPost('Engineer ' + str(number)) for number in range(jobs)])
+        agency.close()
+        elapsed = time.perf_counter() - started
+
+        for subscriber in subscribers:
+            subscriber.join()
+        print(str(processCount) + ' subscriber processes: ' + str(int(jobs * processCount / elapsed))
+              + ' deliveries/s')
+
 
 johnDoe = JobSeeker('John Doe')
 janeDoe = JobSeeker('Jane Doe')
@@ -44,3 +589,33 @@ Output
 Hi John Doe! New job posted: Software Engineer
 Hi Jane Doe! New job posted: Software Engineer
 '''
+
+pythonDoe = JobSeeker('Python Doe')
+jobPostings.attach(pythonDoe, keywords=['python'], predicate=lambda job: 'senior' not in job.getTitle().lower())
+
+jobPostings.addJobs([JobPost('Python Developer'), JobPost('Senior Python Developer'), JobPost('Designer')])
+
+if __name__ == '__main__':
+    threadedPostings = ThreadedEmploymentAgency(policy='coalesce')
+    threadedPostings.attach(johnDoe)
+    threadedPostings.addJob(JobPost('Data Engineer'))
+    threadedPostings.shutdown()
+    print(threadedPostings.metrics()[0]['delivered'])  # 1
+
+    async def postAsync():
+        asyncPostings = AsyncEmploymentAgency(policy='block', capacity=2)
+        asyncPostings.attach(janeDoe)
+        await asyncPostings.addJobs([JobPost('Site Reliability Engineer'), JobPost('QA Engineer'), JobPost('Data Engineer')])
+        await asyncPostings.join()
+        asyncPostings.close()
+
+    asyncio.run(postAsync())
+
+    socketPath = os.path.join(tempfile.mkdtemp(), 'agency.sock')
+    socketPostings = SocketEmploymentAgency(socketPath)
+    remoteSeeker = multiprocessing.Process(target=subscribeJobs, args=(socketPath, JobSeeker('Remote Doe'), ['engineer']))
+    remoteSeeker.start()
+    socketPostings.accept(1)
+    socketPostings.addJobs([JobPost('Platform Engineer'), JobPost('Designer')])
+    socketPostings.close()
+    remoteSeeker.join()
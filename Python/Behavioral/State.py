@@ -1,18 +1,27 @@
+import sys
+
+
 class WritingState:
     def write(self, words):
         pass
 
 class UpperCase(WritingState):
+    transform = staticmethod(str.upper)
+
     def write(self, words):
         print(words.upper())
 
 
 class LowerCase(WritingState):
+    transform = staticmethod(str.lower)
+
     def write(self, words):
         print(words.lower())
 
 
 class DefaultText(WritingState):
+    transform = staticmethod(str)
+
     def write(self, words):
         print(words)
 
@@ -29,6 +38,61 @@ class TextEditor():
     def type(self, words):
         self._state.write(words)
 
+
+class CompiledTextEditor(TextEditor):
+    # States compile down to a table of string transforms, so a line costs one lookup and one call
+    _table = None
+    _sink = None
+    _chunkSize = None
+    _buffer = None
+    _buffered = 0
+
+    def __init__(self, state, sink=None, chunkSize=1 << 16):
+        super().__init__(state)
+        self._table = {}
+        self._sink = sink or sys.stdout
+        self._chunkSize = chunkSize
+        self._buffer = []
+
+    def _transform(self, state):
+        stateClass = type(state)
+        transform = self._table.get(stateClass)
+        if transform is None:
+            transform = getattr(stateClass, 'transform', None)
+            if transform is None:
+                raise TypeError(stateClass.__name__ + ' has no transform to compile')
+            self._table[stateClass] = transform
+        return transform
+
+    def type(self, words):
+        self.type_many([words])
+
+    def type_many(self, lines):
+        # A WritingState instance in the stream switches state for the lines that follow it
+        transform = self._transform(self._state)
+        buffer = self._buffer
+        buffered = self._buffered
+        for line in lines:
+            if isinstance(line, WritingState):
+                self._state = line
+                transform = self._transform(line)
+                continue
+            buffer.append(transform(line))
+            buffered += 1
+            if buffered >= self._chunkSize:
+                self._buffered = buffered
+                self.flush()
+                buffer = self._buffer
+                buffered = 0
+        self._buffered = buffered
+
+    def flush(self):
+        if self._buffer:
+            self._buffer.append('')
+            self._sink.write('\n'.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
 editor = TextEditor(DefaultText())
 editor.type('First Line')
 editor.setState(UpperCase())
@@ -39,4 +103,8 @@ editor.type('Third Line')
 editor.setState(LowerCase())
 
 editor.type('Fourth Line')
-editor.type('Fifth Line')
\ No newline at end of file
+editor.type('Fifth Line')
+
+compiledEditor = CompiledTextEditor(DefaultText())
+compiledEditor.type_many(['First Line', UpperCase(), 'Second Line', 'Third Line', LowerCase(), 'Fourth Line'])
+compiledEditor.flush()
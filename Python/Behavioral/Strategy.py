@@ -1,3 +1,24 @@
+import contextlib
+import heapq
+import io
+import json
+import math
+import operator
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 class SortStrategy:
     def sort(self, dataset):
         pass
@@ -6,12 +27,336 @@ class BubbleSortStrategy(SortStrategy):
     def sort(self, dataset):
         print('Sorting using bubble sort')
 
-        return dataset
+        items = list(dataset)
+        for end in range(len(items) - 1, 0, -1):
+            swapped = False
+            for index in range(end):
+                if items[index + 1] < items[index]:
+                    items[index], items[index + 1] = items[index + 1], items[index]
+                    swapped = True
+            if not swapped:
+                break
+        return items
 
 class QuickSortStrategy(SortStrategy):
     def sort(self, dataset):
         print('Sorting using quick sort')
-        return dataset
+
+        # Iterative three-way quicksort so neither recursion depth nor runs of duplicates can blow up
+        items = list(dataset)
+        ranges = [(0, len(items) - 1)]
+        while ranges:
+            low, high = ranges.pop()
+            if low >= high:
+                continue
+            pivot = sorted((items[low], items[(low + high) // 2], items[high]))[1]
+            less, index, greater = low, low, high
+            while index <= greater:
+                if items[index] < pivot:
+                    items[less], items[index] = items[index], items[less]
+                    less += 1
+                    index += 1
+                elif pivot < items[index]:
+                    items[index], items[greater] = items[greater], items[index]
+                    greater -= 1
+                else:
+                    index += 1
+            ranges.append((low, less - 1))
+            ranges.append((greater + 1, high))
+        return items
+
+def profileDataset(items, sampleSize=1024):
+    # Type and bounds need a full pass; order and duplicates are estimated from an evenly spaced sample
+    size = len(items)
+    profile = {'size': size, 'kind': 'other', 'presorted': 1.0, 'duplicates': 0.0, 'low': None, 'high': None}
+    if size < 2:
+        return profile
+
+    if all(type(item) is int for item in items):
+        profile['kind'] = 'int'
+        profile['low'], profile['high'] = min(items), max(items)
+    elif all(type(item) is float for item in items):
+        profile['kind'] = 'float'
+    elif all(type(item) in (int, float) for item in items):
+        profile['kind'] = 'mixed'
+
+    sample = items[::max(1, size // sampleSize)]
+    if len(sample) > 1:
+        profile['presorted'] = sum(map(operator.le, sample, islice(sample, 1, None))) / (len(sample) - 1)
+    try:
+        profile['duplicates'] = 1 - len(set(sample)) / len(sample)
+    except TypeError:
+        pass
+    return profile
+
+def countingSort(items, low, high):
+    counts = [0] * (high - low + 1)
+    for item in items:
+        counts[item - low] += 1
+    result = []
+    for offset, count in enumerate(counts):
+        if count:
+            result.extend([low + offset] * count)
+    return result
+
+class AdaptiveSortStrategy(SortStrategy):
+    lastProfile = None
+    lastChoice = None
+    _numpyThreshold = None
+    _countingRangeFactor = None
+
+    def __init__(self, numpyThreshold=100000, countingRangeFactor=0.1):
+        self._numpyThreshold = numpyThreshold
+        self._countingRangeFactor = countingRangeFactor
+
+    def sort(self, dataset):
+        items = list(dataset)
+        profile = profileDataset(items)
+        self.lastProfile = profile
+        size = profile['size']
+
+        if profile['kind'] == 'int' and profile['presorted'] < 0.9 \
+                and profile['high'] - profile['low'] <= self._countingRangeFactor * size:
+            self.lastChoice = 'counting'
+            return countingSort(items, profile['low'], profile['high'])
+        # Only homogeneous input goes through numpy: a mixed list would come back with every int turned into a float
+        if numpy is not None and profile['kind'] in ('int', 'float') and size >= self._numpyThreshold:
+            self.lastChoice = 'numpy'
+            try:
+                return numpy.sort(numpy.asarray(items)).tolist()
+            except OverflowError:
+                pass
+        self.lastChoice = 'timsort'
+        return sorted(items)
+
+def readDataset(dataset, parse=int):
+    # A path means a file with one value per line; anything else is consumed as an iterable
+    if isinstance(dataset, (str, os.PathLike)):
+        with open(dataset) as lines:
+            for line in lines:
+                if line.strip():
+                    yield parse(line)
+    else:
+        yield from dataset
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+class ParallelMergeSortStrategy(SortStrategy):
+    _workers = None
+    _chunkSize = None
+    _parse = None
+
+    def __init__(self, workers=None, chunkSize=100000, parse=int):
+        self._workers = workers or os.cpu_count()
+        self._chunkSize = chunkSize
+        self._parse = parse
+
+    def sort(self, dataset):
+        chunks = chunked(readDataset(dataset, self._parse), self._chunkSize)
+        with ProcessPoolExecutor(self._workers) as pool:
+            runs = list(pool.map(sorted, chunks))
+        return list(heapq.merge(*runs))
+
+class ExternalSortStrategy(SortStrategy):
+    _runSize = None
+    _blockSize = None
+    _maxFanIn = None
+    _parse = None
+    _directory = None
+
+    def __init__(self, runSize=100000, blockSize=4096, maxFanIn=64, parse=int, directory=None):
+        self._runSize = runSize
+        self._blockSize = blockSize
+        self._maxFanIn = maxFanIn
+        self._parse = parse
+        self._directory = directory
+
+    def sort(self, dataset):
+        # Returns a lazy MergedRuns iterator; at most one run is held in memory while spilling, and one block per
+        # run while merging. If spilling fails, every run written so far is removed before the error propagates
+        written = []
+        try:
+            runs = []
+            for chunk in chunked(readDataset(dataset, self._parse), self._runSize):
+                runs.append(self._writeRun(sorted(chunk)))
+                written.append(runs[-1])
+            while len(runs) > self._maxFanIn:
+                groups = [runs[start:start + self._maxFanIn] for start in range(0, len(runs), self._maxFanIn)]
+                runs = []
+                for group in groups:
+                    runs.append(self._writeRun(self._merge(group)))
+                    written.append(runs[-1])
+        except BaseException:
+            removeFiles(written)
+            raise
+        return self._merge(runs)
+
+    def _writeRun(self, items):
+        handle, path = tempfile.mkstemp(suffix='.run', dir=self._directory)
+        try:
+            with os.fdopen(handle, 'wb') as run:
+                for block in chunked(items, self._blockSize):
+                    pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            removeFiles([path])
+            raise
+        return path
+
+    def _readRun(self, path):
+        with open(path, 'rb') as run:
+            while True:
+                try:
+                    block = pickle.load(run)
+                except EOFError:
+                    return
+                yield from block
+
+    def _merge(self, paths):
+        return MergedRuns([self._readRun(path) for path in paths], paths)
+
+def removeFiles(paths):
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+class MergedRuns:
+    # Merges sorted runs lazily and removes their files once it is exhausted, closed or garbage collected,
+    # so a result that is dropped without being iterated does not leave runs behind
+    _readers = None
+    _paths = None
+    _merged = None
+
+    def __init__(self, readers, paths):
+        self._readers = readers
+        self._paths = paths
+        self._merged = heapq.merge(*readers)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._merged)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self._paths is None:
+            return
+        self._merged = iter(())
+        for reader in self._readers:
+            reader.close()
+        removeFiles(self._paths)
+        self._readers = self._paths = None
+
+    def __del__(self):
+        self.close()
+
+# name -> (factory, largest size worth benchmarking)
+STRATEGIES = {}
+
+def registerStrategy(name, factory, maxSize=None):
+    STRATEGIES[name] = (factory, maxSize)
+
+registerStrategy('bubble', BubbleSortStrategy, maxSize=2000)
+registerStrategy('quick', QuickSortStrategy)
+registerStrategy('adaptive', AdaptiveSortStrategy)
+registerStrategy('parallel', ParallelMergeSortStrategy)
+registerStrategy('external', ExternalSortStrategy)
+
+DISTRIBUTIONS = {
+    'random': lambda size: [random.randint(0, 1 << 30) for _ in range(size)],
+    'sorted': lambda size: list(range(size)),
+    'reversed': lambda size: list(range(size, 0, -1)),
+    'fewUnique': lambda size: [random.randint(0, 16) for _ in range(size)],
+    'floats': lambda size: [random.random() for _ in range(size)],
+}
+
+def classifyDistribution(profile):
+    if profile['kind'] in ('float', 'mixed'):
+        return 'floats'
+    if profile['presorted'] >= 0.99:
+        return 'sorted'
+    if profile['presorted'] <= 0.01:
+        return 'reversed'
+    if profile['duplicates'] >= 0.9:
+        return 'fewUnique'
+    return 'random'
+
+def calibrate(path, sizes=(1000, 10000, 100000), repeats=3):
+    results = []
+    best = {}
+    for distribution, generate in DISTRIBUTIONS.items():
+        best[distribution] = []
+        for size in sizes:
+            data = generate(size)
+            timings = {}
+            for name, (factory, maxSize) in STRATEGIES.items():
+                if maxSize is not None and size > maxSize:
+                    continue
+                strategy = factory()
+                seconds = float('inf')
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        list(strategy.sort(data))
+                    seconds = min(seconds, time.perf_counter() - started)
+                timings[name] = seconds
+                results.append({'distribution': distribution, 'size': size, 'strategy': name, 'seconds': seconds})
+            best[distribution].append([size, min(timings, key=timings.get)])
+
+    with open(path, 'w') as profileFile:
+        json.dump({'results': results, 'best': best}, profileFile, indent=2)
+    return best
+
+class ProfiledSortStrategy(SortStrategy):
+    lastChoice = None
+    _best = None
+    _strategies = None
+    _sampleSize = None
+
+    def __init__(self, profilePath, sampleSize=10000):
+        with open(profilePath) as profileFile:
+            self._best = json.load(profileFile)['best']
+        self._strategies = {}
+        self._sampleSize = sampleSize
+
+    def choose(self, items, size=None):
+        profile = profileDataset(items)
+        candidates = self._best.get(classifyDistribution(profile)) or self._best['random']
+        size = max(size or profile['size'], 1)
+        if size == math.inf:
+            # A stream longer than the sample: the largest benchmarked size is the closest we know of
+            return max(candidates)[1]
+        # Nearest benchmarked size on a log scale
+        _, name = min(candidates, key=lambda candidate: abs(math.log(candidate[0]) - math.log(size)))
+        return name
+
+    def sort(self, dataset):
+        # Only a bounded prefix is profiled; the chosen strategy gets the prefix followed by the rest of the stream.
+        # Whichever strategy wins, a file path comes back as a lazy iterator and anything else as a list
+        items = readDataset(dataset)
+        prefix = list(islice(items, self._sampleSize))
+        size = None
+        if hasattr(dataset, '__len__') and not isinstance(dataset, str):
+            size = len(dataset)
+        elif len(prefix) == self._sampleSize:
+            size = math.inf
+        name = self.lastChoice = self.choose(prefix, size)
+        strategy = self._strategies.get(name)
+        if strategy is None:
+            strategy = self._strategies[name] = STRATEGIES[name][0]()
+        result = strategy.sort(chain(prefix, items))
+        if isinstance(dataset, (str, os.PathLike)):
+            return iter(result)
+        return result if isinstance(result, list) else list(result)
 
 class Sorter:
     _sorter = None
@@ -22,10 +367,29 @@ class Sorter:
     def sort(self, dataset):
         return self._sorter.sort(dataset)
 
+    @classmethod
+    def fromProfile(cls, profilePath):
+        return cls(ProfiledSortStrategy(profilePath))
+
 dataset = [1, 5, 4, 3, 2, 8]
 
 sorter = Sorter(BubbleSortStrategy())
 sorter.sort(dataset)
 
 sorter = Sorter(QuickSortStrategy())
-sorter.sort(dataset)
\ No newline at end of file
+sorter.sort(dataset)
+
+if __name__ == '__main__':
+    sorter = Sorter(AdaptiveSortStrategy())
+    print(sorter.sort(dataset))  # [1, 2, 3, 4, 5, 8]
+
+    sorter = Sorter(ExternalSortStrategy(runSize=2))
+    print(list(sorter.sort(dataset)))  # [1, 2, 3, 4, 5, 8]
+
+    # python Strategy.py calibrate [profile.json]
+    if sys.argv[1:2] == ['calibrate']:
+        profilePath = sys.argv[2] if len(sys.argv) > 2 else 'sort-profile.json'
+        print(calibrate(profilePath))
+
+        sorter = Sorter.fromProfile(profilePath)
+        print(list(sorter.sort(dataset)))  # [1, 2, 3, 4, 5, 8]
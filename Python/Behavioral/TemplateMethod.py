@@ -1,9 +1,118 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+
 class Builder:
-    def build(self):
-        self.test()
-        self.lint()
-        self.assemble()
-        self.deploy()
+    # step -> steps it waits for; subclasses override this to loosen or tighten the default order
+    dependencies = {
+        'test': [],
+        'lint': ['test'],
+        'assemble': ['lint'],
+        'deploy': ['assemble'],
+    }
+    # step -> files it reads; only steps listed here can be skipped by a StepCache
+    inputs = {}
+
+    def build(self, workers=None, executor=None, cache=None):
+        order = self.stepOrder()
+        keys = self.stepKeys(order, cache) if cache else {}
+        timings = {}
+        remaining = {step: set(self.dependencies[step]) for step in order}
+        running = {}
+        ownExecutor = executor is None
+        if ownExecutor:
+            executor = ThreadPoolExecutor(workers or max(1, len(order)))
+        # After a step fails nothing new starts; steps already running finish, and the first error is raised with
+        # the failed step's name and a report of everything that did finish attached as .step and .report
+        failure = None
+        try:
+            while (remaining and failure is None) or running:
+                if failure is None:
+                    for step in [step for step in order if step in remaining and not remaining[step]]:
+                        del remaining[step]
+                        running[executor.submit(self.runStep, step, cache, keys.get(step))] = step
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        timings[step] = future.result()
+                    except Exception as error:
+                        if failure is None:
+                            failure = error
+                            failure.step = step
+                        continue
+                    for waiting in remaining.values():
+                        waiting.discard(step)
+        finally:
+            if ownExecutor:
+                executor.shutdown()
+        report = BuildReport(self.dependencies, timings)
+        if failure is not None:
+            failure.report = report
+            raise failure
+        return report
+
+    def stepOrder(self):
+        # Kahn's algorithm; raises on unknown or circular dependencies
+        pending = {step: set(needs) for step, needs in self.dependencies.items()}
+        for step, needs in pending.items():
+            unknown = needs - pending.keys()
+            if unknown:
+                raise ValueError(step + ' depends on unknown steps: ' + ', '.join(sorted(unknown)))
+        order = []
+        while pending:
+            ready = [step for step, needs in pending.items() if not needs]
+            if not ready:
+                raise ValueError('Circular step dependencies: ' + ', '.join(sorted(pending)))
+            for step in ready:
+                del pending[step]
+                order.append(step)
+            for needs in pending.values():
+                needs.difference_update(ready)
+        return order
+
+    def stepKeys(self, order, cache):
+        # A step's key covers its own inputs and its dependencies' keys, so upstream changes invalidate it too
+        keys = {}
+        for step in order:
+            needs = self.dependencies[step]
+            if step not in self.inputs or any(need not in keys for need in needs):
+                continue
+            parts = [type(self).__qualname__, step]
+            parts.extend(path + ':' + cache.fileDigest(path) for path in sorted(self.inputs[step]))
+            parts.extend(keys[need] for need in sorted(needs))
+            keys[step] = cache.key(parts)
+        return keys
+
+    def runStep(self, step, cache=None, key=None):
+        started = time.perf_counter()
+        startedCpu = time.thread_time()
+        cached = False
+        if key:
+            try:
+                result = cache.get(key)
+                cached = True
+            except KeyError:
+                pass
+        if not cached:
+            result = getattr(self, step)()
+            if key:
+                cache.put(key, result)
+        return {
+            'started': started,
+            'finished': time.perf_counter(),
+            'cpu': time.thread_time() - startedCpu,
+            'thread': threading.get_ident(),
+            'cached': cached,
+            'result': result,
+        }
 
     def test(self):
         pass
@@ -17,6 +126,209 @@ class Builder:
     def deploy(self):
         pass
 
+class StepCache:
+    _directory = None
+    _maxBytes = None
+    _digests = None
+    _evictLock = None
+
+    def __init__(self, directory, maxBytes=64 << 20):
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._digests = {}
+        self._evictLock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Locks do not pickle; a copy sent to a process pool gets its own
+        state = dict(self.__dict__)
+        del state['_evictLock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._evictLock = threading.Lock()
+
+    def fileDigest(self, path):
+        # Re-hash a file only when its size or modification time moves
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        known = self._digests.get(path)
+        if known and known[0] == signature:
+            return known[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as inputFile:
+            for block in iter(lambda: inputFile.read(1 << 20), b''):
+                digest.update(block)
+        self._digests[path] = (signature, digest.hexdigest())
+        return digest.hexdigest()
+
+    def key(self, parts):
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def contains(self, key):
+        path = self._path(key)
+        try:
+            os.utime(path)  # Touching marks the entry as recently used for eviction
+        except FileNotFoundError:
+            return False
+        return True
+
+    def get(self, key):
+        # Raises KeyError on a miss: no entry, one evicted since contains() saw it, or one that no longer unpickles.
+        # Unreadable entries (truncated, corrupt, or naming a class that has since moved) are deleted on the way
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                result = pickle.load(entry)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+        except Exception:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            raise KeyError(key) from None
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+        with os.fdopen(handle, 'wb') as entry:
+            pickle.dump(result, entry)
+        os.replace(temporaryPath, path)
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key)
+
+    def _evict(self):
+        # Other processes may share the directory, so entries can vanish under us; half-written '.tmp' files are skipped
+        with self._evictLock:
+            entries = []
+            for folder in os.scandir(self._directory):
+                if folder.is_dir():
+                    for entry in os.scandir(folder.path):
+                        if entry.name.startswith('.'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self._maxBytes:
+                    break
+                total -= size
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+
+class BuildReport:
+    _dependencies = None
+    _timings = None
+
+    def __init__(self, dependencies, timings):
+        self._dependencies = dependencies
+        self._timings = timings
+
+    def duration(self, step):
+        return self._timings[step]['finished'] - self._timings[step]['started']
+
+    def cpuTime(self, step):
+        return self._timings[step]['cpu']
+
+    def result(self, step):
+        return self._timings[step]['result']
+
+    def steps(self):
+        return {step: dict(timing) for step, timing in self._timings.items()}
+
+    def criticalPath(self):
+        # Longest chain of dependent steps by duration; that chain bounds the wall time of the build
+        longest = {}
+
+        def chainTo(step):
+            if step not in longest:
+                before = max((chainTo(need) for need in self._dependencies[step]), key=lambda chain: chain[0], default=(0.0, []))
+                longest[step] = (before[0] + self.duration(step), before[1] + [step])
+            return longest[step]
+
+        return max((chainTo(step) for step in self._timings), key=lambda chain: chain[0], default=(0.0, []))
+
+    def wallTime(self):
+        if not self._timings:
+            return 0.0
+        return (max(timing['finished'] for timing in self._timings.values())
+                - min(timing['started'] for timing in self._timings.values()))
+
+    def __str__(self):
+        total, path = self.criticalPath()
+        lines = [step + ': ' + format(self.duration(step), '.3f') + 's' + (' (cached)' if self._timings[step]['cached'] else '')
+                 for step in self._timings]
+        lines.append('critical path: ' + ' -> '.join(path) + ' (' + format(total, '.3f') + 's of '
+                     + format(self.wallTime(), '.3f') + 's wall)')
+        return '\n'.join(lines)
+
+
+def runInstrumented(builder):
+    # Step timings use perf_counter, which is only meaningful within one process; anchor them to the epoch here
+    epochAtStart = time.time()
+    counterAtStart = time.perf_counter()
+    cpuAtStart = time.process_time()
+    # A failing builder still reports the steps that finished, so one bad build does not sink the whole fleet
+    error = None
+    try:
+        report = builder.build()
+    except Exception as failure:
+        report = getattr(failure, 'report', None) or BuildReport(builder.dependencies, {})
+        error = {'step': getattr(failure, 'step', None), 'type': type(failure).__name__, 'message': str(failure)}
+    steps = report.steps()
+    for timing in steps.values():
+        timing['started'] = epochAtStart + timing['started'] - counterAtStart
+        timing['finished'] = epochAtStart + timing['finished'] - counterAtStart
+    return {
+        'builder': type(builder).__name__,
+        'pid': os.getpid(),
+        'started': epochAtStart,
+        'wall': time.perf_counter() - counterAtStart,
+        'cpu': time.process_time() - cpuAtStart,
+        'steps': steps,
+        'error': error,
+    }
+
+
+def runFleet(builders, concurrency=None, tracePath=None):
+    with ProcessPoolExecutor(concurrency) as pool:
+        results = list(pool.map(runInstrumented, builders))
+    if tracePath:
+        writeChromeTrace(results, tracePath)
+    return results
+
+
+def writeChromeTrace(results, tracePath):
+    # Chrome trace event format: open the file in chrome://tracing or ui.perfetto.dev
+    events = []
+    for number, result in enumerate(results):
+        args = {'cpu_ms': result['cpu'] * 1e3, 'fleet_index': number}
+        if result.get('error'):
+            args['error'] = result['error']
+        events.append({
+            'name': result['builder'], 'cat': 'builder', 'ph': 'X', 'pid': result['pid'], 'tid': 0,
+            'ts': result['started'] * 1e6, 'dur': result['wall'] * 1e6, 'args': args,
+        })
+        for step, timing in result['steps'].items():
+            events.append({
+                'name': step, 'cat': 'step', 'ph': 'X', 'pid': result['pid'], 'tid': timing['thread'],
+                'ts': timing['started'] * 1e6, 'dur': (timing['finished'] - timing['started']) * 1e6,
+                'args': {'builder': result['builder'], 'cpu_ms': timing['cpu'] * 1e3, 'cached': timing['cached']},
+            })
+    with open(tracePath, 'w') as trace:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+
+
 class AndroidBuilder(Builder):
     def test(self):
         print('Running android tests')
@@ -65,4 +377,33 @@ Running ios tests
 Linting the ios code
 Assembling the ios build
 Deploying ios build to server
-'''
\ No newline at end of file
+'''
+
+class ParallelIosBuilder(IosBuilder):
+    # Linting does not need the tests to pass, so both run side by side
+    dependencies = {
+        'test': [],
+        'lint': [],
+        'assemble': ['test', 'lint'],
+        'deploy': ['assemble'],
+    }
+
+
+class IncrementalAndroidBuilder(AndroidBuilder):
+    inputs = {
+        'test': [__file__],
+        'lint': [__file__],
+        'assemble': [__file__],
+    }
+
+
+if __name__ == '__main__':
+    print(ParallelIosBuilder().build())
+
+    stepCache = StepCache(os.path.join(tempfile.gettempdir(), 'builder-step-cache'))
+    IncrementalAndroidBuilder().build(cache=stepCache)
+    print(IncrementalAndroidBuilder().build(cache=stepCache))  # test, lint and assemble are cached; deploy always runs
+
+    tracePath = os.path.join(tempfile.gettempdir(), 'fleet-trace.json')
+    for result in runFleet([AndroidBuilder(), IosBuilder(), ParallelIosBuilder()], concurrency=2, tracePath=tracePath):
+        print(result['builder'] + ': ' + format(result['wall'], '.3f') + 's wall, ' + format(result['cpu'], '.3f') + 's cpu')
@@ -1,3 +1,9 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+
 # Visitee
 class Animal:
     def accept(self, operation):
@@ -16,6 +22,8 @@ class AnimalOperation:
 
 
 class Monkey(Animal):
+    visitorMethod = 'visitMonkey'
+
     def shout(self):
         print('Ooh oo aa aa!')
 
@@ -23,6 +31,8 @@ class Monkey(Animal):
         operation.visitMonkey(self)
 
 class Lion(Animal):
+    visitorMethod = 'visitLion'
+
     def roar(self):
         print('Roaaar!')
 
@@ -30,12 +40,79 @@ class Lion(Animal):
         operation.visitLion(self)
 
 class Dolphin(Animal):
+    visitorMethod = 'visitDolphin'
+
     def speak(self):
         print('Tuut tuttu tuutt!')
 
     def accept(self, operation):
         operation.visitDolphin(self)
 
+# (operation class, animal class) -> (bound-method name, whether it takes the whole group)
+dispatchTable = {}
+
+def resolveVisit(operationClass, animalClass):
+    entry = dispatchTable.get((operationClass, animalClass))
+    if entry is None:
+        # Batch hooks are the plural of the single visit method: visitMonkey -> visitMonkeys.
+        # Animals that do not name their visit method are dispatched through accept() instead
+        visitorMethod = getattr(animalClass, 'visitorMethod', None)
+        if visitorMethod is None:
+            entry = (None, False)
+        elif callable(getattr(operationClass, visitorMethod + 's', None)):
+            entry = (visitorMethod + 's', True)
+        else:
+            entry = (visitorMethod, False)
+        dispatchTable[(operationClass, animalClass)] = entry
+    return entry
+
+def apply(operation, animals):
+    # Animals are visited one type at a time, but results come back in the order the animals were given
+    groups = {}
+    total = 0
+    for index, animal in enumerate(animals):
+        group = groups.get(type(animal))
+        if group is None:
+            group = groups[type(animal)] = ([], [])
+        group[0].append(index)
+        group[1].append(animal)
+        total += 1
+
+    results = [None] * total
+    for animalClass, (indexes, group) in groups.items():
+        name, batched = resolveVisit(type(operation), animalClass)
+        if name is None:
+            groupResults = [animal.accept(operation) for animal in group]
+        elif batched:
+            groupResults = getattr(operation, name)(group)
+        else:
+            visit = getattr(operation, name)
+            groupResults = [visit(animal) for animal in group]
+        if groupResults is not None:
+            for index, result in zip(indexes, groupResults):
+                results[index] = result
+    return results
+
+def applyChunk(operation, chunk):
+    return apply(operation, chunk)
+
+_NO_INITIAL = object()
+
+def parallelApply(operation, animals, reducer, initial=_NO_INITIAL, chunkSize=10000, workers=None):
+    # The operation and animals are pickled to the workers, so state the operation builds up stays there;
+    # return it from the visit methods and let the reducer fold the per-chunk result lists together
+    animals = list(animals)
+    chunks = [animals[start:start + chunkSize] for start in range(0, len(animals), chunkSize)]
+    if not chunks:
+        if initial is _NO_INITIAL:
+            raise TypeError('parallelApply() of an empty herd needs an initial value')
+        return initial
+    with ProcessPoolExecutor(workers) as pool:
+        chunkResults = pool.map(applyChunk, [operation] * len(chunks), chunks)
+        if initial is _NO_INITIAL:
+            return reduce(reducer, chunkResults)
+        return reduce(reducer, chunkResults, initial)
+
 class Speak(AnimalOperation):
     def visitMonkey(self, monkey):
         monkey.shout()
@@ -76,3 +153,58 @@ lion.accept(jump)
 
 dolphin.accept(speak)
 dolphin.accept(jump)
+
+class CountLegs(AnimalOperation):
+    def visitMonkeys(self, monkeys):
+        return [2] * len(monkeys)
+
+    def visitLions(self, lions):
+        return [4] * len(lions)
+
+    def visitDolphin(self, dolphin):
+        return 0
+
+class Exercise(AnimalOperation):
+    total = 0
+    effort = None
+
+    def __init__(self, effort=2000):
+        self.effort = effort
+
+    def workout(self, animal, strength):
+        burned = sum(step * strength % 7 for step in range(self.effort))
+        self.total += burned
+        return burned
+
+    def visitMonkey(self, monkey):
+        return self.workout(monkey, 3)
+
+    def visitLion(self, lion):
+        return self.workout(lion, 5)
+
+    def visitDolphin(self, dolphin):
+        return self.workout(dolphin, 2)
+
+def benchmark_parallel_visitor(herdSize=6000, workers=None):
+    workers = workers or os.cpu_count()
+    herd = [Monkey(), Lion(), Dolphin()] * (herdSize // 3)
+
+    exercise = Exercise()
+    started = time.perf_counter()
+    for animal in herd:
+        animal.accept(exercise)
+    serial = time.perf_counter() - started
+
+    started = time.perf_counter()
+    total = parallelApply(Exercise(), herd, lambda total, burned: total + sum(burned), initial=0,
+                          chunkSize=max(1, len(herd) // (workers * 4)), workers=workers)
+    parallel = time.perf_counter() - started
+
+    assert total == exercise.total
+    print(str(workers) + ' workers: serial ' + format(serial, '.2f') + 's, parallel ' + format(parallel, '.2f')
+          + 's, speedup ' + format(serial / parallel, '.2f') + 'x')
+
+if __name__ == '__main__':
+    print(apply(CountLegs(), [monkey, lion, dolphin, monkey]))  # [2, 4, 0, 2]
+
+    benchmark_parallel_visitor()